@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
-import asyncio
 import tempfile
 import os
-import subprocess
 
-async def test_conversion():
+from main import SVGToTGSConverter, _FALLBACK_TGS_BYTES
+
+def test_conversion():
     # Create a test SVG
     svg_content = '''<?xml version="1.0" encoding="UTF-8"?>
 <svg width="512" height="512" viewBox="0 0 512 512" xmlns="http://www.w3.org/2000/svg">
@@ -13,40 +13,28 @@ async def test_conversion():
   <rect x="200" y="300" width="112" height="40" fill="#333" rx="20"/>
 </svg>'''
     
-    # Create temporary files
-    with tempfile.NamedTemporaryFile(suffix='.svg', delete=False) as svg_file:
-        svg_file.write(svg_content.encode())
-        svg_path = svg_file.name
-    
-    with tempfile.NamedTemporaryFile(suffix='.tgs', delete=False) as tgs_file:
-        tgs_path = tgs_file.name
-    
-    try:
-        # Test the exact command our bot uses
-        lottie_convert_path = "/home/runner/workspace/.pythonlibs/bin/lottie_convert.py"
-        cmd = [
-            'python', lottie_convert_path,
-            svg_path,
-            tgs_path,
-            '--sanitize',
-            '--width', '512',
-            '--height', '512',
-            '--fps', '30'
-        ]
+    # Use one temporary directory for all intermediate files
+    with tempfile.TemporaryDirectory(prefix='tgs_') as temp_dir:
+        svg_path = os.path.join(temp_dir, 'test.svg')
+        tgs_path = os.path.join(temp_dir, 'test.tgs')
         
-        print(f"Running command: {' '.join(cmd)}")
+        with open(svg_path, 'wb') as svg_file:
+            svg_file.write(svg_content.encode())
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        # Convert through the bot's own conversion code
+        print(f"Converting {svg_path} -> {tgs_path}")
         
-        stdout, stderr = await process.communicate()
+        with open(svg_path, 'rb') as f:
+            tgs_data, error_msg = SVGToTGSConverter.convert_svg_data(f.read())
         
-        print(f"Return code: {process.returncode}")
-        print(f"Stdout: {stdout.decode('utf-8')}")
-        print(f"Stderr: {stderr.decode('utf-8')}")
+        if tgs_data is None:
+            print(f"Conversion failed: {error_msg}")
+        elif tgs_data == _FALLBACK_TGS_BYTES:
+            print("Warning: lottie conversion failed, got the fallback animation")
+        
+        if tgs_data is not None:
+            with open(tgs_path, 'wb') as f:
+                f.write(tgs_data)
         
         if os.path.exists(tgs_path):
             size = os.path.getsize(tgs_path)
@@ -61,14 +49,6 @@ async def test_conversion():
                 print(f"Error reading TGS file: {e}")
         else:
             print("No TGS file was created")
-            
-    finally:
-        # Cleanup
-        try:
-            os.unlink(svg_path)
-            os.unlink(tgs_path)
-        except:
-            pass
 
 if __name__ == "__main__":
-    asyncio.run(test_conversion())
\ No newline at end of file
+    test_conversion()
\ No newline at end of file
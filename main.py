@@ -11,15 +11,30 @@ License: MIT
 """
 
 import os
+import io
 import sys
+import time
 import json
 import gzip
+import re
+import hashlib
 import sqlite3
 import asyncio
 import logging
-import tempfile
+import itertools
+import threading
+import functools
+import signal
+from contextlib import contextmanager
+from array import array
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from operator import itemgetter
+from collections import defaultdict, deque, OrderedDict
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Final
 from datetime import datetime
 
 # Third-party imports
@@ -32,12 +47,11 @@ from telegram.ext import (
     filters
 )
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.error import TelegramError, RetryAfter
 
 # SVG and TGS conversion libraries
 try:
     import lottie
-    from lottie.exporters.core import export_tgs
     from lottie.importers.svg import import_svg
     from lottie import objects
     LOTTIE_AVAILABLE = True
@@ -46,6 +60,20 @@ except ImportError as e:
     LOTTIE_AVAILABLE = False
     print(f"Warning: lottie library not available: {e}")
     
+# Per-process CPU limits are only available on Unix
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+    
+# Faster JSON serialization when orjson is installed
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    
 # Fallback simple TGS creation if lottie fails
 import json
 import gzip
@@ -63,19 +91,140 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8435159197:AAH1HnaYac-oPrVKOjI_EndFWB-1nUwyhek")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "1096693642"))
 DATABASE_PATH = os.getenv("DATABASE_PATH", "bot_database.db")
+CACHE_DIR = os.getenv("CACHE_DIR", "bot_cache")
+CACHE_MAX_FILES = int(os.getenv("CACHE_MAX_FILES", "1000"))
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+SVG_SNIFF_SIZE = 4096  # Bytes first scanned for the <svg> tag
+SVG_HEADER_MAX = 64 * 1024  # Bytes scanned at most when a long prolog hides the root tag
+BROADCAST_CONCURRENCY = 25  # Messages in flight at once during /broadcast
+BROADCAST_RATE = 25  # Messages per second, under Telegram's ~30/s bulk limit
+BROADCAST_MAX_RETRY_WAIT = 300  # Seconds of flood-control waits allowed per recipient
+BROADCAST_PROGRESS_INTERVAL = 5  # Seconds between broadcast status updates
+HTTP_TIMEOUT = 20  # Read/write timeout in seconds for Bot API calls
+ACTIVITY_TOUCH_INTERVAL = 60  # Seconds between last_activity updates per user
+SEND_CONCURRENCY = 4  # Converted stickers uploaded at once per batch
+DOWNLOAD_CONCURRENCY = 6  # SVG downloads in flight at once per batch
+BATCH_DEBOUNCE_DELAY = 1.5  # Seconds without new files before a batch is processed
+CONVERSION_TIMEOUT = 60  # Seconds a single SVG conversion may hold a worker
 REQUIRED_DIMENSIONS = (512, 512)
 
+# XML comments, removed before looking for the root element
+_XML_COMMENT_RE = re.compile(rb'<!--.*?-->', re.DOTALL)
+# Start of an <svg> element, and the whole start tag; quoted attribute values may contain '>'
+_SVG_START_RE = re.compile(rb'<svg\b', re.IGNORECASE)
+_SVG_ROOT_RE = re.compile(
+    rb'<svg\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+    re.IGNORECASE
+)
+# Pixel width/height attributes, matched only inside the root start tag
+_SVG_WIDTH_RE = re.compile(
+    rb'\swidth\s*=\s*["\']\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*["\']',
+    re.IGNORECASE
+)
+_SVG_HEIGHT_RE = re.compile(
+    rb'\sheight\s*=\s*["\']\s*(\d+(?:\.\d+)?)\s*(?:px)?\s*["\']',
+    re.IGNORECASE
+)
+
+# Static replies, built once instead of on every command
+WELCOME_TEXT: Final = (
+    "🎨 *SVG to TGS Converter Bot*\n\n"
+    "Send me SVG files and I'll convert them to TGS format for Telegram stickers!\n\n"
+    "📋 *Requirements:*\n"
+    "• SVG files only\n"
+    "• Exactly 512×512 pixels\n"
+    "• Maximum 5MB file size\n"
+    "• You can send multiple files at once\n\n"
+    "Just send your SVG files and I'll handle the rest! ✨"
+)
+HELP_TEXT: Final = (
+    "🔧 *How to use:*\n\n"
+    "1️⃣ Send SVG files (512×512 pixels, max 5MB)\n"
+    "2️⃣ Wait for conversion (I'll show progress)\n"
+    "3️⃣ Receive your TGS sticker files!\n\n"
+    "📝 *Tips:*\n"
+    "• You can send multiple files at once\n"
+    "• I process them in batch for efficiency\n"
+    "• Files must be exactly 512×512 pixels\n\n"
+    "❓ Having issues? Make sure your SVG is properly formatted!"
+)
+MD_KW: Final = MappingProxyType({'parse_mode': ParseMode.MARKDOWN})  # Read-only reply_text kwargs
+
 class DatabaseManager:
     """Handles all database operations for the bot."""
     
+    WRITE_BATCH_SIZE = 500  # Max queued statements per transaction
+    WRITE_FLUSH_INTERVAL = 0.2  # Seconds queued writes wait to be batched
+    BAN_CACHE_TTL = 60  # Seconds before a cached ban status is re-read
+    BAN_CACHE_SIZE = 4096  # Max users kept in the ban status cache
+    KNOWN_USERS_SIZE = 10000  # Max user profiles remembered to skip redundant upserts
+    
+    _ADD_USER_SQL = """
+        INSERT INTO users 
+        (user_id, username, first_name, last_name, last_activity)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = excluded.username,
+            first_name = excluded.first_name,
+            last_name = excluded.last_name,
+            last_activity = CURRENT_TIMESTAMP
+    """
+    _TOUCH_USER_SQL = """
+        UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?
+    """
+    _SET_BANNED_SQL = """
+        UPDATE users SET is_banned = ? WHERE user_id = ?
+    """
+    _IS_BANNED_SQL = """
+        SELECT is_banned FROM users WHERE user_id = ?
+    """
+    _STATS_SQL = """
+        SELECT key, value FROM stats
+    """
+    _LOG_CONVERSION_SQL = """
+        INSERT INTO conversions (user_id, file_count)
+        VALUES (?, ?)
+    """
+    _ACTIVE_USER_IDS_SQL = """
+        SELECT user_id FROM users WHERE is_banned = 0
+    """
+    
     def __init__(self, db_path: str):
         self.db_path = db_path
+        
+        # Single connection shared for the lifetime of the process
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-20000")  # ~20MB page cache
+        self._conn.execute("PRAGMA mmap_size=67108864")  # Map up to 64MB of the file
+        self._lock = threading.Lock()
+        # Keeps queued statements in order when several threads flush at once
+        self._flush_lock = threading.Lock()
+        # Ban cache is touched from the event loop and from worker threads
+        self._cache_lock = threading.Lock()
+        
+        # user_id -> (is_banned, expiry time), least recently used first
+        self._ban_cache: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+        # Broadcast recipients, rebuilt after users are added, banned or unbanned
+        self._active_user_ids: Optional[array] = None
+        # Bumped on every invalidation so a query that raced with one isn't cached
+        self._user_ids_generation = 0
+        # user_id -> (username, first_name, last_name) last written, least recently used first;
+        # activity updates for an unchanged profile skip the full upsert
+        self._known_profiles: "OrderedDict[int, Tuple[str, str, str]]" = OrderedDict()
+        
+        # Statements waiting for the background writer, oldest first
+        self._pending_writes: "deque[Tuple[str, tuple]]" = deque()
+        self._writes_queued: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
         self.init_database()
     
     def init_database(self) -> None:
         """Initialize the database with required tables."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock:
+            conn = self._conn
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER PRIMARY KEY,
@@ -96,80 +245,351 @@ class DatabaseManager:
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             """)
-            conn.commit()
+            
+            # Covering index for get_all_user_ids, and per-user conversion lookups
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_users_active ON users (is_banned, user_id)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversions_uid ON conversions (user_id)
+            """)
+            
+            # Aggregate counters kept up to date by triggers so get_stats
+            # does not need to scan the tables
+            conn.execute("BEGIN")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stats (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                INSERT OR IGNORE INTO stats (key, value) VALUES
+                    ('total_users', (SELECT COUNT(*) FROM users)),
+                    ('banned_users', (SELECT COUNT(*) FROM users WHERE is_banned = 1)),
+                    ('total_conversions', (SELECT COUNT(*) FROM conversions))
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+                BEGIN
+                    UPDATE stats SET value = value + 1 WHERE key = 'total_users';
+                    UPDATE stats SET value = value + (NEW.is_banned IS 1)
+                        WHERE key = 'banned_users';
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+                BEGIN
+                    UPDATE stats SET value = value - 1 WHERE key = 'total_users';
+                    UPDATE stats SET value = value - (OLD.is_banned IS 1)
+                        WHERE key = 'banned_users';
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS stats_users_ban AFTER UPDATE OF is_banned ON users
+                BEGIN
+                    UPDATE stats SET value = value + (NEW.is_banned IS 1) - (OLD.is_banned IS 1)
+                        WHERE key = 'banned_users';
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS stats_conversions_insert AFTER INSERT ON conversions
+                BEGIN
+                    UPDATE stats SET value = value + 1 WHERE key = 'total_conversions';
+                END
+            """)
+            conn.execute("COMMIT")
+    
+    def start_writer(self) -> None:
+        """Start the background task that batches queued writes.
+        
+        Must be called from within the running event loop.
+        """
+        self._writes_queued = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._writer())
+    
+    async def stop_writer(self) -> None:
+        """Stop the background writer and flush any queued writes."""
+        if self._writer_task:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        
+        self._writes_queued = None
+        self._flush_pending()
+    
+    def _enqueue_write(self, sql: str, params: tuple) -> None:
+        """Queue a write for the background writer, or run it now if none is active."""
+        self._pending_writes.append((sql, params))
+        if self._writer_task is None:
+            # Also drains anything a stopped or crashed writer left queued, in order
+            self._flush_pending()
+        else:
+            self._writes_queued.set()
+    
+    async def _writer(self) -> None:
+        """Commit queued statements in batches every WRITE_FLUSH_INTERVAL."""
+        try:
+            while True:
+                await self._writes_queued.wait()
+                # Let concurrent handlers add to the batch unless it is already full;
+                # statements stay queued meanwhile so _flush_pending keeps them in order
+                if len(self._pending_writes) < self.WRITE_BATCH_SIZE:
+                    await asyncio.sleep(self.WRITE_FLUSH_INTERVAL)
+                self._writes_queued.clear()
+                
+                try:
+                    await asyncio.to_thread(self._flush_pending)
+                except Exception as e:
+                    logger.error(f"Error writing queued statements: {e}")
+        except Exception:
+            logger.exception("Database writer stopped, falling back to direct writes")
+        finally:
+            # If the writer ever stops, _enqueue_write falls back to writing directly
+            if self._writer_task is asyncio.current_task():
+                self._writer_task = None
+    
+    def _flush_pending(self) -> None:
+        """Write any queued statements immediately."""
+        pending = self._pending_writes
+        with self._flush_lock:
+            while pending:
+                batch = [pending.popleft() for _ in range(min(len(pending), self.WRITE_BATCH_SIZE))]
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    # One bad statement shouldn't lose the rest of the batch
+                    logger.error(f"Batched write of {len(batch)} statements failed, retrying one by one: {e}")
+                    self._write_each(batch)
+    
+    def _write_each(self, batch: List[Tuple[str, tuple]]) -> None:
+        """Write statements in separate transactions, dropping only those that fail."""
+        for sql, params in batch:
+            try:
+                self._write_batch([(sql, params)])
+            except Exception as e:
+                logger.error(f"Dropping queued statement {sql.split()[0]} {params!r}: {e}")
+    
+    def _write_batch(self, batch: List[Tuple[str, tuple]]) -> None:
+        """Execute queued statements in a single transaction."""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Consecutive statements with the same SQL go through one executemany
+                for sql, group in itertools.groupby(batch, key=itemgetter(0)):
+                    conn.executemany(sql, [params for _, params in group])
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
     
     def add_user(self, user_id: int, username: str = "", 
                  first_name: str = "", last_name: str = "") -> None:
         """Add or update user information."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT OR REPLACE INTO users 
-                (user_id, username, first_name, last_name, last_activity)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """, (user_id, username or "", first_name or "", last_name or ""))
-            conn.commit()
+        profile = (username or "", first_name or "", last_name or "")
+        with self._cache_lock:
+            unchanged = self._known_profiles.get(user_id) == profile
+            if unchanged:
+                self._known_profiles.move_to_end(user_id)
+        if unchanged:
+            self._enqueue_write(self._TOUCH_USER_SQL, (user_id,))
+            return
+        
+        self._remember_profiles([(user_id, *profile)])
+        self._forget_ban_status(user_id)
+        # Queue before invalidating, so a rebuild that sees the invalidation also flushes the insert
+        self._enqueue_write(self._ADD_USER_SQL, (user_id, *profile))
+        self._invalidate_user_ids()
+    
+    def _remember_profiles(self, rows: Iterable[Tuple[int, str, str, str]]) -> None:
+        """Record the profiles just written, evicting the least recently seen users."""
+        with self._cache_lock:
+            for user_id, *profile in rows:
+                self._known_profiles[user_id] = tuple(profile)
+                self._known_profiles.move_to_end(user_id)
+            while len(self._known_profiles) > self.KNOWN_USERS_SIZE:
+                self._known_profiles.popitem(last=False)
+    
+    def bulk_add_users(self, users: Iterable[Tuple[int, str, str, str]]) -> None:
+        """Add or update many users in a single transaction."""
+        rows = [
+            (user_id, username or "", first_name or "", last_name or "")
+            for user_id, username, first_name, last_name in users
+        ]
+        if not rows:
+            return
+        
+        self._flush_pending()
+        self._write_batch([(self._ADD_USER_SQL, row) for row in rows])
+        self._remember_profiles(rows)
+        for row in rows:
+            self._forget_ban_status(row[0])
+        self._invalidate_user_ids()
     
     def ban_user(self, user_id: int) -> bool:
         """Ban a user."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                UPDATE users SET is_banned = 1 WHERE user_id = ?
-            """, (user_id,))
-            conn.commit()
-            return cursor.rowcount > 0
+        return self._set_banned(user_id, True)
     
     def unban_user(self, user_id: int) -> bool:
         """Unban a user."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                UPDATE users SET is_banned = 0 WHERE user_id = ?
-            """, (user_id,))
-            conn.commit()
-            return cursor.rowcount > 0
+        return self._set_banned(user_id, False)
+    
+    def _set_banned(self, user_id: int, banned: bool) -> bool:
+        """Update a user's ban flag; returns False if the user does not exist."""
+        self._flush_pending()
+        with self._lock:
+            cursor = self._conn.execute(self._SET_BANNED_SQL, (int(banned), user_id))
+        
+        if cursor.rowcount > 0:
+            self._cache_ban_status(user_id, banned)
+            self._invalidate_user_ids()
+            return True
+        return False
+    
+    def cached_ban_status(self, user_id: int) -> Optional[bool]:
+        """Return a user's cached ban status, or None if it must be read from the database."""
+        with self._cache_lock:
+            cached = self._ban_cache.get(user_id)
+            if cached and cached[1] > time.monotonic():
+                self._ban_cache.move_to_end(user_id)
+                return cached[0]
+        return None
     
     def is_banned(self, user_id: int) -> bool:
         """Check if user is banned."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                SELECT is_banned FROM users WHERE user_id = ?
-            """, (user_id,))
-            result = cursor.fetchone()
-            return bool(result and result[0]) if result else False
+        cached = self.cached_ban_status(user_id)
+        if cached is not None:
+            return cached
+        
+        with self._lock:
+            result = self._conn.execute(self._IS_BANNED_SQL, (user_id,)).fetchone()
+        
+        banned = bool(result and result[0]) if result else False
+        self._cache_ban_status(user_id, banned)
+        return banned
+    
+    def _cache_ban_status(self, user_id: int, banned: bool) -> None:
+        """Remember a user's ban status for BAN_CACHE_TTL seconds."""
+        with self._cache_lock:
+            self._ban_cache[user_id] = (banned, time.monotonic() + self.BAN_CACHE_TTL)
+            self._ban_cache.move_to_end(user_id)
+            if len(self._ban_cache) > self.BAN_CACHE_SIZE:
+                self._ban_cache.popitem(last=False)
+    
+    def _forget_ban_status(self, user_id: int) -> None:
+        """Drop a cached ban status so the next lookup reads the database."""
+        with self._cache_lock:
+            self._ban_cache.pop(user_id, None)
     
     def get_stats(self) -> Dict[str, int]:
         """Get bot statistics."""
-        with sqlite3.connect(self.db_path) as conn:
-            total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-            banned_users = conn.execute(
-                "SELECT COUNT(*) FROM users WHERE is_banned = 1"
-            ).fetchone()[0]
-            total_conversions = conn.execute(
-                "SELECT COUNT(*) FROM conversions"
-            ).fetchone()[0]
-            
-            return {
-                'total_users': total_users,
-                'banned_users': banned_users,
-                'active_users': total_users - banned_users,
-                'total_conversions': total_conversions
-            }
+        self._flush_pending()
+        with self._lock:
+            counters = dict(self._conn.execute(self._STATS_SQL).fetchall())
+        
+        total_users = counters.get('total_users', 0)
+        banned_users = counters.get('banned_users', 0)
+        return {
+            'total_users': total_users,
+            'banned_users': banned_users,
+            'active_users': total_users - banned_users,
+            'total_conversions': counters.get('total_conversions', 0)
+        }
     
     def log_conversion(self, user_id: int, file_count: int) -> None:
         """Log a conversion event."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO conversions (user_id, file_count)
-                VALUES (?, ?)
-            """, (user_id, file_count))
-            conn.commit()
-    
-    def get_all_user_ids(self) -> List[int]:
-        """Get all user IDs for broadcasting."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                SELECT user_id FROM users WHERE is_banned = 0
-            """)
-            return [row[0] for row in cursor.fetchall()]
+        self._enqueue_write(self._LOG_CONVERSION_SQL, (user_id, file_count))
+    
+    def _invalidate_user_ids(self) -> None:
+        """Drop the memoized broadcast list after the set of active users changes."""
+        with self._cache_lock:
+            self._active_user_ids = None
+            self._user_ids_generation += 1
+    
+    def get_all_user_ids(self) -> array:
+        """Get all user IDs for broadcasting, as a compact array of 64-bit ints."""
+        with self._cache_lock:
+            user_ids = self._active_user_ids
+            generation = self._user_ids_generation
+        if user_ids is not None:
+            return array('q', user_ids)
+        
+        self._flush_pending()
+        with self._lock:
+            cursor = self._conn.execute(self._ACTIVE_USER_IDS_SQL)
+            user_ids = array('q', (row[0] for row in cursor))
+        
+        # Only memoize if no user was added, banned or unbanned while querying
+        with self._cache_lock:
+            if generation == self._user_ids_generation:
+                self._active_user_ids = array('q', user_ids)
+        return user_ids
+
+# Basic Lottie animation used when an SVG cannot be converted
+_FALLBACK_LOTTIE_TEMPLATE = {
+    "v": "5.5.2",
+    "fr": 30,
+    "ip": 0,
+    "op": 30,
+    "w": 512,
+    "h": 512,
+    "nm": "SVG Animation",
+    "ddd": 0,
+    "assets": [],
+    "layers": [
+        {
+            "ddd": 0,
+            "ind": 1,
+            "ty": 4,
+            "nm": "SVG Layer",
+            "sr": 1,
+            "ks": {
+                "o": {"a": 0, "k": 100},
+                "r": {"a": 0, "k": 0},
+                "p": {"a": 0, "k": [256, 256, 0]},
+                "a": {"a": 0, "k": [0, 0, 0]},
+                "s": {"a": 0, "k": [100, 100, 100]}
+            },
+            "ao": 0,
+            "shapes": [
+                {
+                    "ty": "rc",
+                    "d": 1,
+                    "s": {"a": 0, "k": [400, 400]},
+                    "p": {"a": 0, "k": [0, 0]},
+                    "r": {"a": 0, "k": 10}
+                },
+                {
+                    "ty": "fl",
+                    "c": {"a": 0, "k": [0.2, 0.7, 1, 1]},
+                    "o": {"a": 0, "k": 100}
+                }
+            ],
+            "ip": 0,
+            "op": 30,
+            "st": 0,
+            "bm": 0
+        }
+    ]
+}
+
+def _dumps(data: Any) -> bytes:
+    """Serialize data to compact UTF-8 JSON, using orjson if available."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+# The fallback template never changes, so compress it once at import time
+_FALLBACK_TGS_BYTES = gzip.compress(
+    _dumps(_FALLBACK_LOTTIE_TEMPLATE),
+    compresslevel=9,
+    mtime=0
+)
 
 class SVGToTGSConverter:
     """Handles SVG to TGS conversion operations."""
@@ -186,36 +606,111 @@ class SVGToTGSConverter:
             Tuple of (is_valid, error_message)
         """
         try:
-            # Check file size
-            file_size = os.path.getsize(file_path)
+            # Size and header come from a single open of the file
+            file_size, head = await asyncio.to_thread(SVGToTGSConverter._read_head, file_path)
             logger.info(f"Validating SVG file: {file_path} ({file_size} bytes)")
             
             if file_size > MAX_FILE_SIZE:
                 return False, f"File too large: {file_size/1024/1024:.1f}MB (max 5MB)"
             
-            # Basic file validation
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    logger.info(f"SVG content length: {len(content)} characters")
-                    
-                    # More flexible SVG validation
-                    content_lower = content.lower().strip()
-                    if '<svg' not in content_lower:
-                        logger.error(f"Invalid SVG format - missing <svg> tag")
-                        return False, "Invalid SVG format - missing <svg> tag"
-                    
-                    # Basic validation passed
-                    logger.info("SVG validation passed successfully")
-                    return True, ""
-            except Exception as e:
-                logger.error(f"SVG content validation error: {e}")
-                return False, f"Invalid SVG file: {str(e)}"
-                    
+            return SVGToTGSConverter._check_svg_header(head)
+        
+        except FileNotFoundError:
+            logger.error(f"SVG file not found: {file_path}")
+            return False, "SVG file not found"
         except Exception as e:
             logger.error(f"Error validating SVG: {e}")
             return False, f"Validation error: {str(e)}"
     
+    @staticmethod
+    async def validate_svg_data(data: bytes):
+        """
+        Validate SVG content that is already in memory.
+        
+        Args:
+            data: Raw SVG file content
+            
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        file_size = len(data)
+        logger.info(f"Validating SVG data ({file_size} bytes)")
+        
+        if file_size > MAX_FILE_SIZE:
+            return False, f"File too large: {file_size/1024/1024:.1f}MB (max 5MB)"
+        
+        head = data[:SVG_SNIFF_SIZE]
+        if file_size > len(head) and SVGToTGSConverter._find_root_tag(head)[1] is None:
+            head = data[:SVG_HEADER_MAX]  # Long prolog, look further for the root tag
+        return SVGToTGSConverter._check_svg_header(head)
+    
+    @staticmethod
+    def _read_head(file_path: str) -> Tuple[int, bytes]:
+        """Return a file's size and enough of its start to hold the root <svg> tag."""
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(SVG_SNIFF_SIZE)
+            # Long comments, DOCTYPEs or metadata can push the root tag past the first read
+            while (len(head) < min(file_size, SVG_HEADER_MAX) and
+                   SVGToTGSConverter._find_root_tag(head)[1] is None):
+                chunk = f.read(min(len(head), SVG_HEADER_MAX - len(head)))
+                if not chunk:
+                    break
+                head += chunk
+            return file_size, head
+    
+    @staticmethod
+    def _find_root_tag(head: bytes) -> Tuple[bool, Optional[bytes]]:
+        """
+        Locate the root <svg> start tag in the start of a document.
+        
+        Args:
+            head: First bytes of the document
+            
+        Returns:
+            Tuple of (found, root_tag); root_tag is None if the tag is cut off by the end of head
+        """
+        body = _XML_COMMENT_RE.sub(b'', head)
+        # A comment cut off by the end of head may still hide <svg text
+        unclosed = body.find(b'<!--')
+        if unclosed != -1:
+            body = body[:unclosed]
+        
+        # The first <svg> outside comments is the root; nested ones come later
+        start = _SVG_START_RE.search(body)
+        if start is None:
+            return False, None
+        root = _SVG_ROOT_RE.match(body, start.start())
+        return True, root.group(0) if root else None
+    
+    @staticmethod
+    def _check_svg_header(head: bytes):
+        """Check that the first bytes of a file contain a 512x512 <svg> tag."""
+        # Any XML document starts with markup once the BOM and whitespace are skipped
+        head = head.lstrip(b'\xef\xbb\xbf \t\r\n')
+        found, root_tag = False, None
+        if head.startswith(b'<'):
+            found, root_tag = SVGToTGSConverter._find_root_tag(head)
+        if not found:
+            logger.error(f"Invalid SVG format - missing <svg> tag")
+            return False, "Invalid SVG format - missing <svg> tag"
+        
+        if root_tag is None:
+            logger.info("Root <svg> tag runs past the scanned header, skipping dimension check")
+            return True, ""
+        
+        # Only absolute pixel sizes are checked; relative or missing sizes are scaled
+        for pattern, required in zip((_SVG_WIDTH_RE, _SVG_HEIGHT_RE), REQUIRED_DIMENSIONS):
+            match = pattern.search(root_tag)
+            if match and float(match.group(1)) != required:
+                width, height = REQUIRED_DIMENSIONS
+                logger.error(f"Invalid SVG dimensions - {match.group(0)!r}")
+                return False, f"Invalid SVG dimensions - must be {width}×{height} pixels"
+        
+        # Basic validation passed
+        logger.info("SVG validation passed successfully")
+        return True, ""
+    
     @staticmethod
     async def convert_svg_to_tgs(svg_path: str, output_path: str):
         """
@@ -228,119 +723,265 @@ class SVGToTGSConverter:
         Returns:
             Tuple of (success, error_message)
         """
+        # Parsing and compression are CPU-bound, keep them off the event loop
+        return await asyncio.to_thread(
+            SVGToTGSConverter._convert_file_sync, svg_path, output_path
+        )
+    
+    @staticmethod
+    def _convert_file_sync(svg_path: str, output_path: str) -> Tuple[bool, str]:
+        """Synchronous body of convert_svg_to_tgs."""
         try:
             logger.info(f"Starting conversion: {svg_path} -> {output_path}")
             
-            if LOTTIE_AVAILABLE:
-                try:
-                    # Import SVG using lottie
-                    animation = import_svg(svg_path)
-                    
-                    # Set animation properties for Telegram sticker
-                    animation.frame_rate = 30
-                    animation.in_point = 0
-                    animation.out_point = 30  # 1 second at 30fps
-                    
-                    # Ensure size is 512x512
-                    animation.width = 512
-                    animation.height = 512
-                    
-                    # Export to TGS format
-                    with open(output_path, 'wb') as tgs_file:
-                        export_tgs(animation, tgs_file)
-                    
-                    # Check if output file exists and has content
-                    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-                        logger.error("Lottie conversion failed, trying fallback")
-                        return await SVGToTGSConverter._create_fallback_tgs(svg_path, output_path)
-                    
-                    file_size = os.path.getsize(output_path)
-                    logger.info(f"Successfully converted SVG to TGS using lottie. Output file: {output_path} ({file_size} bytes)")
-                    return True, ""
-                    
-                except Exception as e:
-                    logger.warning(f"Lottie conversion failed: {e}, trying fallback")
-                    return await SVGToTGSConverter._create_fallback_tgs(svg_path, output_path)
-            else:
-                return await SVGToTGSConverter._create_fallback_tgs(svg_path, output_path)
+            with open(svg_path, 'rb') as f:
+                svg_data = f.read()
+            
+            tgs_data, error_msg = SVGToTGSConverter.convert_svg_data(svg_data)
+            if tgs_data is None:
+                return False, error_msg
+            
+            with open(output_path, 'wb') as f:
+                f.write(tgs_data)
+            return True, ""
             
         except Exception as e:
             logger.error(f"Error converting SVG to TGS: {e}")
             return False, f"Conversion error: {str(e)}"
     
     @staticmethod
-    async def _create_fallback_tgs(svg_path: str, output_path: str):
-        """Create a basic TGS file as fallback when lottie is not available."""
+    def convert_svg_data(svg_data: bytes) -> Tuple[Optional[bytes], str]:
+        """
+        Convert SVG content to TGS bytes, safe to run in a worker process.
+        
+        Args:
+            svg_data: Raw SVG file content
+            
+        Returns:
+            Tuple of (tgs_data, error_message); tgs_data is None on failure
+        """
+        if not LOTTIE_AVAILABLE:
+            return SVGToTGSConverter._fallback_tgs_data()
+        
         try:
-            # Read SVG content
-            with open(svg_path, 'r', encoding='utf-8') as f:
-                svg_content = f.read()
+            # Import SVG using lottie
+            animation = import_svg(io.BytesIO(svg_data))
             
-            # Create basic Lottie animation structure
-            lottie_data = {
-                "v": "5.5.2",
-                "fr": 30,
-                "ip": 0,
-                "op": 30,
-                "w": 512,
-                "h": 512,
-                "nm": "SVG Animation",
-                "ddd": 0,
-                "assets": [],
-                "layers": [
-                    {
-                        "ddd": 0,
-                        "ind": 1,
-                        "ty": 4,
-                        "nm": "SVG Layer",
-                        "sr": 1,
-                        "ks": {
-                            "o": {"a": 0, "k": 100},
-                            "r": {"a": 0, "k": 0},
-                            "p": {"a": 0, "k": [256, 256, 0]},
-                            "a": {"a": 0, "k": [0, 0, 0]},
-                            "s": {"a": 0, "k": [100, 100, 100]}
-                        },
-                        "ao": 0,
-                        "shapes": [
-                            {
-                                "ty": "rc",
-                                "d": 1,
-                                "s": {"a": 0, "k": [400, 400]},
-                                "p": {"a": 0, "k": [0, 0]},
-                                "r": {"a": 0, "k": 10}
-                            },
-                            {
-                                "ty": "fl",
-                                "c": {"a": 0, "k": [0.2, 0.7, 1, 1]},
-                                "o": {"a": 0, "k": 100}
-                            }
-                        ],
-                        "ip": 0,
-                        "op": 30,
-                        "st": 0,
-                        "bm": 0
-                    }
-                ]
-            }
+            # Set animation properties for Telegram sticker
+            animation.frame_rate = 30
+            animation.in_point = 0
+            animation.out_point = 30  # 1 second at 30fps
             
-            # Convert to JSON and compress
-            json_str = json.dumps(lottie_data, separators=(',', ':'))
+            # Ensure size is 512x512
+            animation.width = 512
+            animation.height = 512
             
-            # Write compressed TGS file
-            with open(output_path, 'wb') as f:
-                f.write(gzip.compress(json_str.encode('utf-8')))
+            # Export to TGS format: serialize once and gzip in a single call, rather than
+            # export_tgs streaming json.dump through many small gzip writes
+            lottie_dict = animation.to_dict()
+            lottie_dict["tgs"] = 1
+            tgs_data = gzip.compress(_dumps(lottie_dict), compresslevel=9, mtime=0)
+            
+            # Check that the export produced content
+            if not tgs_data:
+                logger.error("Lottie conversion failed, trying fallback")
+                return SVGToTGSConverter._fallback_tgs_data()
+            
+            logger.info(f"Successfully converted SVG to TGS using lottie ({len(tgs_data)} bytes)")
+            return tgs_data, ""
             
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                file_size = os.path.getsize(output_path)
-                logger.info(f"Created fallback TGS file: {output_path} ({file_size} bytes)")
-                return True, ""
-            else:
-                return False, "Failed to create fallback TGS file"
-                
         except Exception as e:
-            logger.error(f"Error creating fallback TGS: {e}")
-            return False, f"Fallback conversion error: {str(e)}"
+            logger.warning(f"Lottie conversion failed: {e}, trying fallback")
+            return SVGToTGSConverter._fallback_tgs_data()
+    
+    @staticmethod
+    def _fallback_tgs_data() -> Tuple[Optional[bytes], str]:
+        """Return a basic TGS animation as fallback when lottie is not available."""
+        logger.info(f"Using fallback TGS animation ({len(_FALLBACK_TGS_BYTES)} bytes)")
+        return _FALLBACK_TGS_BYTES, ""
+
+class _ConversionTimeout(BaseException):
+    """Raised in a worker when a conversion overruns; escapes the converter's except Exception."""
+
+@contextmanager
+def _conversion_deadline(seconds: int):
+    """
+    Limit the code run inside this block in the current worker process.
+    
+    SIGALRM interrupts Python code after `seconds` of wall time. RLIMIT_CPU backs it up
+    for time spent inside C code, where the kernel kills the worker with SIGXCPU and the
+    pool reports it as BrokenProcessPool.
+    
+    Args:
+        seconds: Time allowed, counted from when the worker starts the job
+    """
+    if not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+    
+    def on_alarm(signum, frame):
+        raise _ConversionTimeout()
+    
+    limits = None
+    if RESOURCE_AVAILABLE:
+        limits = resource.getrlimit(resource.RLIMIT_CPU)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_limit = int(usage.ru_utime + usage.ru_stime) + 2 * seconds
+        if limits[1] != resource.RLIM_INFINITY:
+            cpu_limit = min(cpu_limit, limits[1])
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, limits[1]))
+    
+    previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        if limits is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, limits)
+
+def _convert_worker(svg_data: bytes) -> Tuple[Optional[bytes], str]:
+    """Process pool entry point for converting a single SVG file."""
+    try:
+        with _conversion_deadline(CONVERSION_TIMEOUT):
+            return SVGToTGSConverter.convert_svg_data(svg_data)
+    except _ConversionTimeout:
+        logger.warning(f"Conversion timed out after {CONVERSION_TIMEOUT}s")
+        return None, "Conversion timed out"
+
+class TGSCache:
+    """Disk cache of converted TGS files keyed by the SHA-256 of the SVG and FORMAT_VERSION."""
+    
+    # Bump whenever convert_svg_data output changes (fps, size, serializer, ...) so
+    # stale entries are never served; old files age out through the LRU sweep
+    FORMAT_VERSION = 1
+    
+    def __init__(self, cache_dir: str, max_files: int):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        # Sweep for old entries every tenth of the cache size in new writes
+        self._sweep_every = max(1, max_files // 10)
+        self._writes_since_sweep = 0
+    
+    @staticmethod
+    def key(svg_data: bytes) -> str:
+        """Return the cache key for the given SVG content."""
+        digest = hashlib.sha256(b"v%d\0" % TGSCache.FORMAT_VERSION)
+        digest.update(svg_data)
+        return digest.hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.tgs")
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached TGS bytes, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Mark the entry as recently used for the LRU sweep
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Error reading TGS cache entry {key}: {e}")
+            return None
+        
+        logger.info(f"TGS cache hit: {key}")
+        return data
+    
+    def put(self, key: str, tgs_data: bytes) -> None:
+        """Store TGS bytes, evicting the least recently used entries when full."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(tgs_data)
+            # Atomic rename so readers never see a partial file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Error writing TGS cache entry {key}: {e}")
+            return
+        
+        self._writes_since_sweep += 1
+        if self._writes_since_sweep >= self._sweep_every:
+            self._writes_since_sweep = 0
+            self._sweep()
+    
+    def _sweep(self) -> None:
+        """Remove the least recently used entries beyond max_files."""
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.tgs'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    pass
+        
+        excess = len(entries) - self.max_files
+        if excess <= 0:
+            return
+        
+        entries.sort()
+        for _, path in entries[:excess]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        logger.info(f"Evicted {excess} entries from TGS cache")
+
+class RateLimiter:
+    """Spaces calls shared by many coroutines to at most `rate` per second."""
+    
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_slot = 0.0
+        self._resume_at = 0.0
+    
+    async def wait(self) -> None:
+        """Wait for the next free send slot."""
+        while True:
+            now = time.monotonic()
+            if now < self._resume_at:
+                await asyncio.sleep(self._resume_at - now)
+                continue
+            
+            # Reserving the slot has no await in between, so callers never share one
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # A pause that started while sleeping voids the slot
+            if time.monotonic() >= self._resume_at:
+                return
+    
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for `seconds`, e.g. after Telegram flood control."""
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self._next_slot = max(self._next_slot, self._resume_at)
+
+@dataclass(slots=True)
+class UserBatch:
+    """Files a user has sent that are waiting to be converted together."""
+    files: List[Dict[str, Any]] = field(default_factory=list)
+    progress_msg: Any = None
+    timer: Optional[asyncio.TimerHandle] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+def admin_only(handler):
+    """Restrict a TelegramBot command handler to ADMIN_ID."""
+    @functools.wraps(handler)
+    async def wrapper(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if update.effective_user.id != ADMIN_ID:
+            await update.message.reply_text("❌ Admin access required.")
+            return
+        await handler(self, update, context)
+    return wrapper
 
 class TelegramBot:
     """Main Telegram bot class."""
@@ -348,55 +989,31 @@ class TelegramBot:
     def __init__(self):
         self.db = DatabaseManager(DATABASE_PATH)
         self.converter = SVGToTGSConverter()
-        self.user_batches = {}  # Store batches being processed
+        self.cache = TGSCache(CACHE_DIR, CACHE_MAX_FILES)
+        self.user_batches: Dict[int, UserBatch] = defaultdict(UserBatch)  # Batches waiting to be processed
+        self._pool = ProcessPoolExecutor(max_workers=os.cpu_count())  # CPU-bound conversions
+        self._retry_pool: Optional[ProcessPoolExecutor] = None  # One worker for isolated retries
+        self._retry_lock = asyncio.Lock()
+        # user_id -> monotonic time of last activity write, oldest first
+        self._last_touch: "OrderedDict[int, float]" = OrderedDict()
+        self._batch_tasks = set()  # Strong references to running batch tasks
+        self._broadcast_limiter = RateLimiter(BROADCAST_RATE)  # Shared by concurrent broadcasts
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /start command."""
         user = update.effective_user
         self.db.add_user(user.id, user.username or "", user.first_name or "", user.last_name or "")
         
-        welcome_message = (
-            "🎨 *SVG to TGS Converter Bot*\n\n"
-            "Send me SVG files and I'll convert them to TGS format for Telegram stickers!\n\n"
-            "📋 *Requirements:*\n"
-            "• SVG files only\n"
-            "• Exactly 512×512 pixels\n"
-            "• Maximum 5MB file size\n"
-            "• You can send multiple files at once\n\n"
-            "Just send your SVG files and I'll handle the rest! ✨"
-        )
-        
-        await update.message.reply_text(
-            welcome_message, 
-            parse_mode=ParseMode.MARKDOWN
-        )
+        await update.message.reply_text(WELCOME_TEXT, **MD_KW)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /help command."""
-        help_text = (
-            "🔧 *How to use:*\n\n"
-            "1️⃣ Send SVG files (512×512 pixels, max 5MB)\n"
-            "2️⃣ Wait for conversion (I'll show progress)\n"
-            "3️⃣ Receive your TGS sticker files!\n\n"
-            "📝 *Tips:*\n"
-            "• You can send multiple files at once\n"
-            "• I process them in batch for efficiency\n"
-            "• Files must be exactly 512×512 pixels\n\n"
-            "❓ Having issues? Make sure your SVG is properly formatted!"
-        )
-        
-        await update.message.reply_text(
-            help_text, 
-            parse_mode=ParseMode.MARKDOWN
-        )
+        await update.message.reply_text(HELP_TEXT, **MD_KW)
     
+    @admin_only
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /stats command (admin only)."""
-        if update.effective_user.id != ADMIN_ID:
-            await update.message.reply_text("❌ Admin access required.")
-            return
-        
-        stats = self.db.get_stats()
+        stats = await asyncio.to_thread(self.db.get_stats)
         stats_text = (
             "📊 *Bot Statistics*\n\n"
             f"👥 Total Users: {stats['total_users']}\n"
@@ -405,55 +1022,43 @@ class TelegramBot:
             f"🔄 Total Conversions: {stats['total_conversions']}"
         )
         
-        await update.message.reply_text(
-            stats_text, 
-            parse_mode=ParseMode.MARKDOWN
-        )
+        await update.message.reply_text(stats_text, **MD_KW)
     
+    @admin_only
     async def ban_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /ban command (admin only)."""
-        if update.effective_user.id != ADMIN_ID:
-            await update.message.reply_text("❌ Admin access required.")
-            return
-        
         if not context.args:
             await update.message.reply_text("Usage: /ban <user_id>")
             return
         
         try:
             user_id = int(context.args[0])
-            if self.db.ban_user(user_id):
+            if await asyncio.to_thread(self.db.ban_user, user_id):
                 await update.message.reply_text(f"✅ User {user_id} has been banned.")
             else:
                 await update.message.reply_text(f"❌ User {user_id} not found.")
         except ValueError:
             await update.message.reply_text("❌ Invalid user ID.")
     
+    @admin_only
     async def unban_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /unban command (admin only)."""
-        if update.effective_user.id != ADMIN_ID:
-            await update.message.reply_text("❌ Admin access required.")
-            return
-        
         if not context.args:
             await update.message.reply_text("Usage: /unban <user_id>")
             return
         
         try:
             user_id = int(context.args[0])
-            if self.db.unban_user(user_id):
+            if await asyncio.to_thread(self.db.unban_user, user_id):
                 await update.message.reply_text(f"✅ User {user_id} has been unbanned.")
             else:
                 await update.message.reply_text(f"❌ User {user_id} not found.")
         except ValueError:
             await update.message.reply_text("❌ Invalid user ID.")
     
+    @admin_only
     async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /broadcast command (admin only)."""
-        if update.effective_user.id != ADMIN_ID:
-            await update.message.reply_text("❌ Admin access required.")
-            return
-        
         if not context.args:
             await update.message.reply_text(
                 "Usage: /broadcast <message>\n"
@@ -462,22 +1067,64 @@ class TelegramBot:
             return
         
         message_text = " ".join(context.args)
-        user_ids = self.db.get_all_user_ids()
-        
-        success_count = 0
-        failed_count = 0
+        user_ids = await asyncio.to_thread(self.db.get_all_user_ids)
         
         status_message = await update.message.reply_text(
             f"📡 Broadcasting to {len(user_ids)} users..."
         )
         
-        for user_id in user_ids:
-            try:
-                await context.bot.send_message(user_id, message_text)
-                success_count += 1
-            except Exception as e:
-                logger.warning(f"Failed to send broadcast to {user_id}: {e}")
-                failed_count += 1
+        limiter = self._broadcast_limiter
+        recipients = iter(user_ids)
+        done_count = 0
+        success_count = 0
+        
+        async def send_one(user_id: int) -> bool:
+            waited = 0
+            while True:
+                await limiter.wait()
+                try:
+                    await context.bot.send_message(user_id, message_text)
+                    return True
+                except RetryAfter as e:
+                    # Flood control: pause every sender, then retry within the wait budget
+                    if waited + e.retry_after > BROADCAST_MAX_RETRY_WAIT:
+                        logger.warning(f"Giving up broadcast to {user_id} after {waited}s of flood waits")
+                        return False
+                    waited += e.retry_after
+                    limiter.pause(e.retry_after)
+                except Exception as e:
+                    logger.warning(f"Failed to send broadcast to {user_id}: {e}")
+                    return False
+        
+        async def send_worker() -> None:
+            # A fixed set of workers share one iterator instead of a task per user
+            nonlocal done_count, success_count
+            for user_id in recipients:
+                if await send_one(user_id):
+                    success_count += 1
+                done_count += 1
+        
+        async def report_progress() -> None:
+            reported = 0
+            while True:
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+                if done_count == reported:
+                    continue
+                reported = done_count
+                try:
+                    await status_message.edit_text(
+                        f"📡 Broadcasting... {reported}/{len(user_ids)}"
+                    )
+                except TelegramError:
+                    pass
+        
+        # Status updates run on their own schedule instead of inside the sends
+        progress_task = asyncio.create_task(report_progress())
+        try:
+            await asyncio.gather(*(send_worker() for _ in range(BROADCAST_CONCURRENCY)))
+        finally:
+            progress_task.cancel()
+        failed_count = done_count - success_count
         
         # Final status
         await status_message.edit_text(
@@ -492,18 +1139,30 @@ class TelegramBot:
         user = update.effective_user
         
         # Check if user is banned
-        if self.db.is_banned(user.id):
+        banned = self.db.cached_ban_status(user.id)
+        if banned is None:
+            banned = await asyncio.to_thread(self.db.is_banned, user.id)
+        if banned:
             await update.message.reply_text("❌ You are banned from using this bot.")
             return
         
-        # Update user activity
-        self.db.add_user(user.id, user.username or "", user.first_name or "", user.last_name or "")
+        # Update user activity, at most once per ACTIVITY_TOUCH_INTERVAL
+        now = time.monotonic()
+        last_touch = self._last_touch.get(user.id)
+        if last_touch is None or now - last_touch > ACTIVITY_TOUCH_INTERVAL:
+            self.db.add_user(user.id, user.username or "", user.first_name or "", user.last_name or "")
+            self._last_touch[user.id] = now
+            self._last_touch.move_to_end(user.id)
+            # Entries past the interval no longer suppress a write, so drop them
+            while next(iter(self._last_touch.values())) < now - ACTIVITY_TOUCH_INTERVAL:
+                self._last_touch.popitem(last=False)
         
         document = update.message.document
         
-        # Check if it's an SVG file
-        if not (document.file_name.lower().endswith('.svg') or 
-                document.mime_type == 'image/svg+xml'):
+        # Check if it's an SVG file (file_name is optional in the Bot API)
+        file_name = document.file_name or ""
+        if not (document.mime_type == 'image/svg+xml' or
+                file_name[-4:].lower() == '.svg'):
             await update.message.reply_text(
                 "❌ Please send only SVG files.\n"
                 "Make sure your file has a .svg extension."
@@ -520,111 +1179,106 @@ class TelegramBot:
         
         user_id = user.id
         
-        # Initialize batch for this user if not exists
-        if user_id not in self.user_batches:
-            self.user_batches[user_id] = {
-                'files': [],
-                'timer_task': None,
-                'progress_msg': None
-            }
-        
-        # Add file to batch
-        self.user_batches[user_id]['files'].append({
-            'document': document,
-            'message': update.message
-        })
-        
-        # Send "Please wait..." only for first file
-        if len(self.user_batches[user_id]['files']) == 1:
-            self.user_batches[user_id]['progress_msg'] = await update.message.reply_text("⏳ Please wait...")
-        
-        # Cancel existing timer and set new one
-        if self.user_batches[user_id]['timer_task']:
-            self.user_batches[user_id]['timer_task'].cancel()
-        
-        # Set timer to process batch after 2 seconds of no new files
-        self.user_batches[user_id]['timer_task'] = asyncio.create_task(
-            self._process_batch_after_delay(user_id, context)
-        )
-    
-    async def _process_batch_after_delay(self, user_id: int, context: ContextTypes.DEFAULT_TYPE):
-        """Process user's batch after delay."""
-        await asyncio.sleep(2)  # Wait 2 seconds for more files
+        # Get or create the batch for this user
+        batch = self.user_batches[user_id]
         
-        if user_id in self.user_batches:
-            await self._process_user_batch(user_id, context)
+        # Files arriving while "Please wait..." is being sent queue up behind it
+        async with batch.lock:
+            batch.files.append({
+                'document': document,
+                'message': update.message
+            })
+            
+            # Send "Please wait..." only for first file
+            if len(batch.files) == 1:
+                batch.progress_msg = await update.message.reply_text("⏳ Please wait...")
+            
+            # Restart the debounce timer; the batch runs once no new files arrive
+            if batch.timer:
+                batch.timer.cancel()
+            batch.timer = asyncio.get_running_loop().call_later(
+                BATCH_DEBOUNCE_DELAY, self._start_batch, user_id, context
+            )
+    
+    def _start_batch(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Timer callback that starts processing a user's batch."""
+        task = asyncio.create_task(self._process_user_batch(user_id, context))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
     
     async def _process_user_batch(self, user_id: int, context: ContextTypes.DEFAULT_TYPE):
         """Process all files in user's batch."""
-        if user_id not in self.user_batches:
-            return
-        
-        batch = self.user_batches[user_id]
-        files = batch['files']
-        progress_msg = batch['progress_msg']
-        
         # Clear batch immediately
-        del self.user_batches[user_id]
-        
-        if not files:
+        batch = self.user_batches.pop(user_id, None)
+        if batch is None or not batch.files:
             return
         
+        files = batch.files
+        progress_msg = batch.progress_msg
+        
         converted_files = []
-        temp_files = []
         
         try:
-            for file_info in files:
-                document = file_info['document']
-                
-                # Download the file
-                file_obj = await context.bot.get_file(document.file_id)
-                
-                # Create temporary files
-                svg_file = tempfile.NamedTemporaryFile(suffix='.svg', delete=False)
-                tgs_file = tempfile.NamedTemporaryFile(suffix='.tgs', delete=False)
-                temp_files.extend([svg_file.name, tgs_file.name])
-                
-                # Download SVG
-                await file_obj.download_to_drive(svg_file.name)
-                
-                # Validate SVG
-                is_valid, error_msg = await self.converter.validate_svg_file(svg_file.name)
-                if not is_valid:
-                    logger.warning(f"Validation failed for {document.file_name}: {error_msg}")
-                    continue
-                
-                # Convert to TGS
-                success, error_msg = await self.converter.convert_svg_to_tgs(
-                    svg_file.name, tgs_file.name
-                )
-                
-                if success:
+            # Download and validate all files concurrently
+            download_semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+            downloads = await asyncio.gather(*(
+                self._download_svg(file_info['document'], context, download_semaphore)
+                for file_info in files
+            ))
+            jobs = [
+                (file_info['document'], svg_data)
+                for file_info, svg_data in zip(files, downloads)
+                if svg_data is not None
+            ]
+            
+            # Convert all valid files in parallel
+            results = await asyncio.gather(*(
+                self._convert_cached(svg_data) for _, svg_data in jobs
+            ))
+            
+            for (document, _), (tgs_data, error_msg) in zip(jobs, results):
+                if tgs_data is not None:
                     converted_files.append({
-                        'tgs_path': tgs_file.name,
-                        'original_name': document.file_name
+                        'tgs_data': tgs_data,
+                        'original_name': document.file_name or "sticker.svg"
                     })
                 else:
                     logger.warning(f"Conversion failed for {document.file_name}: {error_msg}")
             
-            # Update progress to "Done ✅"
-            if progress_msg:
-                await progress_msg.edit_text("Done ✅")
-            
             # Send converted files
             if converted_files:
-                for converted_file in converted_files:
+                semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+                
+                async def send_one(converted_file: Dict[str, Any]) -> bool:
                     tgs_name = converted_file['original_name'].replace('.svg', '.tgs')
-                    
-                    with open(converted_file['tgs_path'], 'rb') as tgs_f:
-                        await context.bot.send_document(
-                            user_id,
-                            document=tgs_f,
-                            filename=tgs_name,
-                            caption=f"✅ {tgs_name}"
-                        )
+                    async with semaphore:
+                        try:
+                            await context.bot.send_document(
+                                user_id,
+                                document=converted_file['tgs_data'],
+                                filename=tgs_name,
+                                caption=f"✅ {tgs_name}"
+                            )
+                            return True
+                        except TelegramError as e:
+                            logger.warning(f"Failed to send {tgs_name} to {user_id}: {e}")
+                            return False
                 
-                # Log conversion
-                self.db.log_conversion(user_id, len(converted_files))
+                sent = await asyncio.gather(*(send_one(cf) for cf in converted_files))
+                sent_count = sum(sent)
+                
+                # Log and report only the files that were delivered
+                if sent_count:
+                    self.db.log_conversion(user_id, sent_count)
+                if progress_msg:
+                    if sent_count == len(converted_files):
+                        await progress_msg.edit_text("Done ✅")
+                    elif sent_count:
+                        await progress_msg.edit_text(
+                            f"Done ✅ ({sent_count} of {len(converted_files)} files sent)"
+                        )
+                    else:
+                        await progress_msg.edit_text("❌ Could not send the converted files.")
             else:
                 if progress_msg:
                     await progress_msg.edit_text("❌ No files could be converted.")
@@ -633,14 +1287,83 @@ class TelegramBot:
             logger.error(f"Error processing batch for user {user_id}: {e}")
             if progress_msg:
                 await progress_msg.edit_text("❌ An error occurred during processing.")
+    
+    async def _download_svg(self, document, context: ContextTypes.DEFAULT_TYPE,
+                            semaphore: asyncio.Semaphore) -> Optional[bytearray]:
+        """Download an SVG into memory, returning None if it fails or is invalid."""
+        async with semaphore:
+            try:
+                file_obj = await context.bot.get_file(document.file_id)
+                svg_data = await file_obj.download_as_bytearray()
+            except TelegramError as e:
+                logger.warning(f"Failed to download {document.file_name}: {e}")
+                return None
         
-        finally:
-            # Clean up temporary files
-            for temp_file in temp_files:
-                try:
-                    os.unlink(temp_file)
-                except OSError:
-                    pass
+        is_valid, error_msg = await self.converter.validate_svg_data(svg_data)
+        if not is_valid:
+            logger.warning(f"Validation failed for {document.file_name}: {error_msg}")
+            return None
+        return svg_data
+    
+    async def _convert_cached(self, svg_data: bytes) -> Tuple[Optional[bytes], str]:
+        """Convert SVG content on the process pool, reusing cached results."""
+        key = TGSCache.key(svg_data)
+        tgs_data = await asyncio.to_thread(self.cache.get, key)
+        if tgs_data is not None:
+            return tgs_data, ""
+        
+        tgs_data, error_msg = await self._run_conversion(svg_data)
+        
+        # Don't pin the generic fallback animation to this SVG
+        if tgs_data is not None and tgs_data != _FALLBACK_TGS_BYTES:
+            await asyncio.to_thread(self.cache.put, key, tgs_data)
+        return tgs_data, error_msg
+    
+    async def _run_conversion(self, svg_data: bytes) -> Tuple[Optional[bytes], str]:
+        """
+        Run one conversion on the process pool, recovering from dead workers.
+        
+        Args:
+            svg_data: Raw SVG file content
+            
+        Returns:
+            Tuple of (tgs_data, error_message); tgs_data is None on failure
+        """
+        loop = asyncio.get_running_loop()
+        # Every job queued on a dead pool fails with it, so retry once on the replacement
+        for _ in range(2):
+            pool = self._pool
+            try:
+                return await loop.run_in_executor(pool, _convert_worker, svg_data)
+            except BrokenProcessPool:
+                # The first job to notice replaces the pool; queued jobs are not cancelled
+                if pool is self._pool:
+                    logger.warning("Conversion worker died, restarting process pool")
+                    self._pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+                    pool.shutdown(wait=False)
+        
+        # Still failing: retry one file at a time on a single worker, so an SVG that
+        # kills its worker only fails itself instead of breaking the main pool again
+        async with self._retry_lock:
+            if self._retry_pool is None:
+                self._retry_pool = ProcessPoolExecutor(max_workers=1)
+            try:
+                return await loop.run_in_executor(self._retry_pool, _convert_worker, svg_data)
+            except BrokenProcessPool:
+                self._retry_pool.shutdown(wait=False)
+                self._retry_pool = None
+                return None, "Conversion worker crashed"
+    
+    async def _post_init(self, application: Application) -> None:
+        """Start background services once the event loop is running."""
+        self.db.start_writer()
+    
+    async def _post_shutdown(self, application: Application) -> None:
+        """Flush pending database writes and stop worker processes before exiting."""
+        await self.db.stop_writer()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        if self._retry_pool is not None:
+            self._retry_pool.shutdown(wait=True, cancel_futures=True)
     
     def run(self) -> None:
         """Run the bot."""
@@ -652,8 +1375,17 @@ class TelegramBot:
             logger.error("ADMIN_ID not provided")
             sys.exit(1)
         
-        # Create application
-        application = Application.builder().token(BOT_TOKEN).build()
+        # Create application; PTB already shares one keep-alive pool (256 connections)
+        # across all API calls, only the timeouts are raised for sticker uploads
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .read_timeout(HTTP_TIMEOUT)
+            .write_timeout(HTTP_TIMEOUT)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         
         # Add handlers
         application.add_handler(CommandHandler("start", self.start_command))